@@ -3,11 +3,9 @@
 Contains the GoogleAIController class for browser automation and response parsing.
 """
 import logging
-import re
 import time
-from playwright.sync_api import Page, TimeoutError as PlaywrightTimeoutError
-from bs4 import BeautifulSoup
-from bs4.element import NavigableString, Tag
+from playwright.sync_api import Page, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+from selectolax.lexbor import LexborHTMLParser
 
 from config import (
     RESPONSE_CONTAINER_SELECTOR,
@@ -18,6 +16,132 @@ from config import (
     LIST_SELECTOR
 )
 
+# Every block the extractor renders, matched in document order by one query.
+BLOCK_SELECTOR = f"{HEADING_SELECTOR}, {PARAGRAPH_SELECTOR}, {LIST_SELECTOR}"
+
+# Bare class names for membership checks against an element's class set.
+HEADING_CLASS = HEADING_SELECTOR[1:]
+PARAGRAPH_CLASS = PARAGRAPH_SELECTOR[1:]
+LIST_CLASS = LIST_SELECTOR[1:]
+
+def _bold_markdown(node) -> str:
+    return f"**{node.text(strip=True)}**"
+
+def _italic_markdown(node) -> str:
+    return f"*{node.text(strip=True)}*"
+
+def _link_markdown(node) -> str:
+    href = node.attributes.get('href') or ''
+    return f"[{node.text(strip=True)}]({href})"
+
+# Markdown renderers for inline formatting tags, keyed by tag name.
+INLINE_MARKDOWN_RENDERERS = {
+    'b': _bold_markdown,
+    'strong': _bold_markdown,
+    'i': _italic_markdown,
+    'em': _italic_markdown,
+    'a': _link_markdown,
+}
+
+# Outermost inline formatting tags outside headings (which are rendered as
+# plain text). Nested tags are left alone so they collapse into their parent's
+# plain text, e.g. <b>x <i>y</i></b> renders as **xy**.
+INLINE_TAGS = ', '.join(INLINE_MARKDOWN_RENDERERS)
+INLINE_MARKDOWN_SELECTOR = (
+    f":is({INLINE_TAGS}):not(:is({INLINE_TAGS}) *):not({HEADING_SELECTOR} *)"
+)
+
+# Extracts heading/paragraph/list blocks from the last response container in
+# document order, rendering inline formatting the same way as the selectolax
+# fallback. Returns null if the container is missing.
+EXTRACT_RESPONSE_SCRIPT = """
+({container, blockSelector, heading, paragraph}) => {
+    const containers = document.querySelectorAll(container);
+    const root = containers[containers.length - 1];
+    if (!root) {
+        return null;
+    }
+    // Matches selectolax's text(strip=True): each text node stripped, then joined.
+    const strippedText = (el) => {
+        const walker = document.createTreeWalker(el, NodeFilter.SHOW_TEXT);
+        let text = '';
+        for (let node = walker.nextNode(); node; node = walker.nextNode()) {
+            text += node.nodeValue.trim();
+        }
+        return text;
+    };
+    const renderers = {
+        b: (el) => `**${strippedText(el)}**`,
+        strong: (el) => `**${strippedText(el)}**`,
+        i: (el) => `*${strippedText(el)}*`,
+        em: (el) => `*${strippedText(el)}*`,
+        a: (el) => `[${strippedText(el)}](${el.getAttribute('href') || ''})`,
+    };
+    const appendInline = (el, parts) => {
+        for (const child of el.childNodes) {
+            if (child.nodeType === Node.TEXT_NODE) {
+                parts.push(child.nodeValue);
+            } else if (child.nodeType === Node.ELEMENT_NODE) {
+                const render = renderers[child.localName];
+                if (render) {
+                    parts.push(render(child));
+                } else {
+                    appendInline(child, parts);
+                }
+            }
+        }
+        return parts;
+    };
+    const inlineMarkdown = (el) => appendInline(el, []).join('');
+    const blocks = root.querySelectorAll(blockSelector);
+    return Array.from(blocks, (el) => {
+        if (el.matches(heading)) {
+            return {type: 'heading', text: strippedText(el)};
+        }
+        if (el.matches(paragraph)) {
+            return {type: 'paragraph', text: inlineMarkdown(el).trim()};
+        }
+        const items = Array.from(el.children).filter((li) => li.localName === 'li');
+        return {type: 'list', items: items.map((li) => inlineMarkdown(li).trim())};
+    });
+}
+"""
+
+# Adaptive polling schedule (seconds): reset to the minimum on activity,
+# multiply by the backoff factor while idle, never exceed the maximum.
+POLL_MIN_INTERVAL = 0.1
+POLL_MAX_INTERVAL = 1.0
+POLL_BACKOFF = 1.5
+
+# Resolves once the last response container has gone `quietMs` without a
+# mutation, returning its text length (0 if the container is missing), or -1
+# if `timeoutMs` elapses first. Runs entirely in the page, so the wait costs
+# a single CDP round-trip instead of one per polling tick.
+DOM_STABILIZATION_SCRIPT = """
+({selector, quietMs, timeoutMs}) => new Promise(resolve => {
+    const nodes = document.querySelectorAll(selector);
+    const el = nodes[nodes.length - 1];
+    if (!el) {
+        resolve(0);
+        return;
+    }
+    let quietTimer;
+    const observer = new MutationObserver(() => {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(() => finish(el.innerText.length), quietMs);
+    });
+    const deadline = setTimeout(() => finish(-1), timeoutMs);
+    const finish = (result) => {
+        observer.disconnect();
+        clearTimeout(quietTimer);
+        clearTimeout(deadline);
+        resolve(result);
+    };
+    observer.observe(el, {childList: true, subtree: true, characterData: true});
+    quietTimer = setTimeout(() => finish(el.innerText.length), quietMs);
+})
+"""
+
 class GoogleAIController:
     """Handles interactions with an already-opened Google AI page."""
 
@@ -25,113 +149,203 @@ class GoogleAIController:
         self.page = page
         self._last_network_activity = 0
         self._streaming_detected = False
+        self._monitoring = False
+
+    def _is_stream_response(self, response) -> bool:
+        """Returns True for the /async/ requests that carry streamed answer chunks."""
+        return "/async/" in response.url
 
     def _response_handler(self, response):
         """Callback to track network responses."""
-        if "/async/" in response.url:
+        if self._is_stream_response(response):
             logging.debug("Network activity detected: %s", response.url)
             self._streaming_detected = True
             self._last_network_activity = time.time()
 
-    def wait_for_response_completion(self, timeout=90):
-        """Waits for the AI response by monitoring network inactivity."""
-        logging.info("Waiting for response stream to complete...")
-        self.page.on("response", self._response_handler)
+    def start_response_monitoring(self):
+        """Starts tracking response stream traffic.
+
+        Call this before navigating so the first streamed chunk is not missed;
+        wait_for_response_completion starts monitoring itself otherwise.
+        Calling it again resets the tracked state for a new prompt.
+        """
         self._last_network_activity = time.time()
         self._streaming_detected = False
+        if not self._monitoring:
+            self.page.on("response", self._response_handler)
+            self._monitoring = True
+
+    def _stop_response_monitoring(self):
+        """Detaches the response listener registered by start_response_monitoring."""
+        if self._monitoring:
+            self.page.remove_listener("response", self._response_handler)
+            self._monitoring = False
+
+    def wait_for_response_completion(self, timeout=90, deadline=None):
+        """Waits for the AI response by monitoring network inactivity.
+
+        If deadline (a time.monotonic() value) is given, every wait, including
+        the DOM fallback, is cut short so the call returns by then.
+        """
+        logging.info("Waiting for response stream to complete...")
+        if not self._monitoring:
+            self.start_response_monitoring()
+
+        def capped(seconds):
+            if deadline is None:
+                return seconds
+            # Playwright treats a timeout of 0 as "wait forever", so keep a floor.
+            return max(0.1, min(seconds, deadline - time.monotonic()))
+
+        timeout = capped(timeout)
         start_time = time.time()
 
-        # First, wait for the streaming to begin.
-        while not self._streaming_detected:
-            if time.time() - start_time > 20:  # 20s timeout to start
-                self.page.remove_listener("response", self._response_handler)
+        # First, wait for the streaming to begin (event-driven, no polling).
+        if not self._streaming_detected:
+            try:
+                first_chunk = self.page.wait_for_event(
+                    "response", predicate=self._is_stream_response, timeout=capped(20) * 1000
+                )
+            except PlaywrightTimeoutError:
+                self._stop_response_monitoring()
                 logging.warning("Network stream never started. Falling back to DOM stabilization.")
-                self.wait_for_dom_stabilization()
+                self.wait_for_dom_stabilization(timeout=capped(120))
                 return
-            self.page.wait_for_timeout(100) # Check every 100ms
+            self._response_handler(first_chunk)
 
-        # Once streaming starts, wait for it to become idle.
-        while time.time() - self._last_network_activity < 3.0:  # 3s of inactivity
+        # Once streaming starts, wait for it to become idle. Each wait runs
+        # exactly until the 3s inactivity deadline unless new activity moved it.
+        while True:
+            idle_remaining = 3.0 - (time.time() - self._last_network_activity)
+            if idle_remaining <= 0:
+                break
             if time.time() - start_time > timeout:
                 logging.warning("Network monitoring timed out after %d seconds.", timeout)
                 break
-            self.page.wait_for_timeout(100)
+            self.page.wait_for_timeout(idle_remaining * 1000)
 
-        self.page.remove_listener("response", self._response_handler)
+        self._stop_response_monitoring()
         logging.info("Network activity has stabilized.")
 
-    def wait_for_dom_stabilization(self):
+    def wait_for_dom_stabilization(self, timeout=120):
         """Fallback: Waits for the text content of the last response to stop growing."""
         logging.info("Waiting for response to finish streaming (DOM fallback)...")
         latest_response = self.page.locator(RESPONSE_CONTAINER_SELECTOR).last
         latest_response.scroll_into_view_if_needed(timeout=5000)
 
+        try:
+            text_len = self.page.evaluate(DOM_STABILIZATION_SCRIPT, {
+                "selector": RESPONSE_CONTAINER_SELECTOR,
+                "quietMs": 3000,  # Requires 3 seconds without mutations
+                "timeoutMs": timeout * 1000,
+            })
+        except PlaywrightError as e:
+            logging.warning("DOM observer failed: %s. Falling back to polling.", e)
+        else:
+            if text_len > 0:
+                logging.info("DOM content stabilized at %d characters.", text_len)
+                return
+            if text_len < 0:
+                logging.warning("DOM stabilization timed out. Response may be incomplete.")
+                return
+            logging.warning("Response is still empty. Falling back to polling.")
+
+        self._poll_dom_stabilization(latest_response, timeout)
+
+    def _poll_dom_stabilization(self, latest_response, timeout):
+        """Polls the response text length until it stops growing.
+
+        The interval resets to POLL_MIN_INTERVAL whenever the length changes
+        and backs off towards POLL_MAX_INTERVAL while it stays put.
+        """
         last_len = 0
-        stable_checks = 0
-        max_stable_checks = 6  # Requires 3 seconds of no growth
-
-        for i in range(240):
-            current_text = latest_response.inner_text(timeout=5000)
-            current_len = len(current_text)
-            logging.debug("DOM check %d: len=%d, last_len=%d, stable=%d",
-                          i + 1, current_len, last_len, stable_checks)
+        last_change = start_time = time.time()
+        interval = POLL_MIN_INTERVAL
+        check = 0
+
+        while time.time() - start_time < timeout:
+            check += 1
+            # Only the length crosses CDP, not the whole response text.
+            current_len = latest_response.evaluate("el => el.innerText.length", timeout=5000)
+            logging.debug("DOM check %d: len=%d, last_len=%d, interval=%.2f",
+                          check, current_len, last_len, interval)
             if current_len > 0 and current_len == last_len:
-                stable_checks += 1
-                if stable_checks >= max_stable_checks:
-                    logging.info("DOM content stabilized after %.1f seconds.", i * 0.5)
+                if time.time() - last_change >= 3.0:  # Requires 3 seconds of no growth
+                    logging.info("DOM content stabilized after %.1f seconds.",
+                                 time.time() - start_time)
                     return
+                interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
             else:
-                stable_checks = 0
+                last_change = time.time()
+                interval = POLL_MIN_INTERVAL
             last_len = current_len
-            time.sleep(0.5)
+            time.sleep(interval)
         logging.warning("DOM stabilization timed out. Response may be incomplete.")
 
-    def _parse_element_to_markdown(self, element) -> str:
-        """Recursively parses a BeautifulSoup element into a Markdown string."""
-        content = ''
-        for child in element.contents:
-            if isinstance(child, NavigableString):
-                content += str(child)
-            elif isinstance(child, Tag):
-                if child.name in ['b', 'strong']:
-                    content += f"**{child.get_text(strip=True)}**"
-                elif child.name in ['i', 'em']:
-                    content += f"*{child.get_text(strip=True)}*"
-                elif child.name == 'a':
-                    href = child.get('href', '')
-                    content += f"[{child.get_text(strip=True)}]({href})"
-                else:
-                    content += self._parse_element_to_markdown(child)
-        return content
+    def _render_inline_markdown(self, tree):
+        """Rewrites inline formatting tags in the tree as Markdown text nodes.
+
+        Replacing the tags in place lets each block be read back with a single
+        `.text()` call instead of a Python-level walk over its children.
+        """
+        renderers = INLINE_MARKDOWN_RENDERERS
+        for node in tree.css(INLINE_MARKDOWN_SELECTOR):
+            node.replace_with(renderers[node.tag](node))
+
+    def _parse_html_to_records(self, html_content: str) -> list:
+        """Parses response HTML into the same block records EXTRACT_RESPONSE_SCRIPT returns."""
+        # Sv6Kpe[...] markers only live in attribute values,
+        # which the extractor never reads, so no pre-parse cleanup pass.
+        tree = LexborHTMLParser(html_content)
+        self._render_inline_markdown(tree)
+        records = []
+
+        for element in tree.css(BLOCK_SELECTOR):
+            class_attrs = set((element.attributes.get('class') or '').split())
+
+            if HEADING_CLASS in class_attrs:
+                records.append({"type": "heading", "text": element.text(strip=True)})
+            elif PARAGRAPH_CLASS in class_attrs:
+                records.append({"type": "paragraph", "text": element.text().strip()})
+            elif LIST_CLASS in class_attrs:
+                items = [li.text().strip() for li in element.iter() if li.tag == 'li']
+                records.append({"type": "list", "items": items})
+        return records
+
+    def _records_to_markdown(self, records: list) -> str:
+        """Assembles block records into the final Markdown string."""
+        markdown_output = []
+        for record in records:
+            if record["type"] == "heading":
+                markdown_output.append(f"\n### {record['text']}\n")
+            elif record["type"] == "paragraph":
+                markdown_output.append(record["text"])
+            elif record["type"] == "list":
+                for item_text in record["items"]:
+                    markdown_output.append(f"* {item_text}")
+                markdown_output.append("")
+        return "\n".join(markdown_output).strip()
 
     def extract_response_as_markdown(self) -> str:
         """Extracts the last AI response and converts its HTML to Markdown."""
         try:
             logging.info("Extracting and parsing the latest response...")
             container = self.page.locator(RESPONSE_CONTAINER_SELECTOR).last
-            html_content = container.inner_html()
-
-            cleaned_html = re.sub(r'Sv6Kpe\[.*?\]', '', html_content)
-
-            soup = BeautifulSoup(cleaned_html, 'lxml')
-            markdown_output = []
 
-            selectors = f"{HEADING_SELECTOR}, {PARAGRAPH_SELECTOR}, {LIST_SELECTOR}"
-            for element in soup.select(selectors):
-                class_attrs = element.get('class') or []
-
-                if HEADING_SELECTOR.strip('.') in class_attrs:
-                    markdown_output.append(f"\n### {element.get_text(strip=True)}\n")
-                elif PARAGRAPH_SELECTOR.strip('.') in class_attrs:
-                    parsed_text = self._parse_element_to_markdown(element).strip()
-                    markdown_output.append(parsed_text)
-                elif LIST_SELECTOR.strip('.') in class_attrs:
-                    for li in element.find_all('li', recursive=False):
-                        item_text = self._parse_element_to_markdown(li).strip()
-                        markdown_output.append(f"* {item_text}")
-                    markdown_output.append("")
+            try:
+                records = self.page.evaluate(EXTRACT_RESPONSE_SCRIPT, {
+                    "container": RESPONSE_CONTAINER_SELECTOR,
+                    "blockSelector": BLOCK_SELECTOR,
+                    "heading": HEADING_SELECTOR,
+                    "paragraph": PARAGRAPH_SELECTOR,
+                })
+            except PlaywrightError as e:
+                logging.warning("In-page extraction failed: %s. Parsing HTML instead.", e)
+                records = None
+            if records is None:
+                records = self._parse_html_to_records(container.inner_html())
 
-            parsed_response = "\n".join(markdown_output).strip()
+            parsed_response = self._records_to_markdown(records)
             if not parsed_response:
                 logging.warning(
                     "Markdown parsing resulted in empty content. "
@@ -141,7 +355,7 @@ class GoogleAIController:
 
             logging.info("Parsing successful.")
             return parsed_response
-        except (AttributeError, TypeError, IndexError) as e:
+        except (AttributeError, TypeError, IndexError, KeyError) as e:
             logging.error("Failed to parse response HTML: %s. Falling back to plain text.", e)
             try:
                 return self.page.locator(RESPONSE_CONTAINER_SELECTOR).last.inner_text()
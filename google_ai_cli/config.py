@@ -8,6 +8,11 @@ SESSION_DIR = Path("./google_ai_session")
 USER_DATA_DIR = SESSION_DIR / "profile"
 PROMPT_HISTORY_FILE = SESSION_DIR / "prompt_history.txt"
 
+# --- Serve mode ---
+# Printed on its own line after each response so stdin/stdout clients can
+# tell where one multi-line answer ends.
+SERVE_END_MARKER = "<<<END OF RESPONSE>>>"
+
 # --- URL ---
 GOOGLE_SEARCH_URL = "https://google.com/search?q={query}&udm=50"
 
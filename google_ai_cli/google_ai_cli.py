@@ -4,13 +4,16 @@
 A command-line interface to control Google's AI search mode.
 """
 import argparse
+import atexit
 import logging
 import sys
 import os
+import time
 from datetime import datetime
+from functools import lru_cache
 from urllib.parse import quote_plus
 
-from playwright.sync_api import Page, TimeoutError as PlaywrightTimeoutError
+from playwright.sync_api import Page, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
 from camoufox.sync_api import Camoufox
 
 from ai_controller import GoogleAIController
@@ -20,20 +23,48 @@ from config import (
     PROMPT_HISTORY_FILE,
     SESSION_DIR,
     RESPONSE_CONTAINER_SELECTOR,
-    NEW_CHAT_BUTTON_SELECTOR
+    NEW_CHAT_BUTTON_SELECTOR,
+    SERVE_END_MARKER
 )
 
+HISTORY_SEPARATOR = "=" * 40
+
+# Clicks the cookie banner's "Accept all" button if present, in one round-trip
+# instead of waiting on a locator. Returns whether a button was clicked.
+ACCEPT_COOKIES_SCRIPT = """
+() => {
+    const button = Array.from(document.querySelectorAll('button'))
+        .find((b) => /Accept all/i.test(b.textContent));
+    if (button) {
+        button.click();
+        return true;
+    }
+    return false;
+}
+"""
+
+# History file handle, opened on the first save and kept for the process lifetime.
+_history_file = None
+
+def _get_history_file():
+    """Returns the open history file, creating SESSION_DIR and opening it once."""
+    global _history_file
+    if _history_file is None:
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        _history_file = open(PROMPT_HISTORY_FILE, "a", buffering=1 << 16, encoding="utf-8")
+        atexit.register(_history_file.close)
+    return _history_file
+
 def save_conversation(prompt: str, response: str):
     """Appends the prompt and response to the history file."""
     try:
-        os.makedirs(SESSION_DIR, exist_ok=True)
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(PROMPT_HISTORY_FILE, "a", encoding="utf-8") as f:
-            f.write(f"--- Prompt sent at {timestamp} ---\n")
-            f.write(f"{prompt}\n\n")
-            f.write("--- Response ---\n")
-            f.write(f"{response}\n")
-            f.write("="*40 + "\n\n")
+        f = _get_history_file()
+        f.write(
+            f"--- Prompt sent at {timestamp} ---\n{prompt}\n\n"
+            f"--- Response ---\n{response}\n{HISTORY_SEPARATOR}\n\n"
+        )
+        f.flush()
         logging.info("Conversation saved to %s", PROMPT_HISTORY_FILE)
     except IOError as e:
         logging.error("Could not write to history file: %s", e)
@@ -41,12 +72,104 @@ def save_conversation(prompt: str, response: str):
 def handle_initial_popups(page: Page):
     """Handles cookie banners or other initial dialogs."""
     try:
-        accept_button = page.locator('button:has-text("Accept all")')
-        if accept_button.is_visible(timeout=5000):
-            accept_button.click()
+        if page.evaluate(ACCEPT_COOKIES_SCRIPT):
             logging.info("Accepted cookie policy.")
-    except PlaywrightTimeoutError:
-        logging.info("No cookie banner found.")
+        else:
+            logging.info("No cookie banner found.")
+    except PlaywrightError as e:
+        logging.warning("Could not check for a cookie banner: %s", e)
+
+@lru_cache(maxsize=128)
+def build_search_url(text: str) -> str:
+    """Returns the AI-mode search URL for a prompt, cached for repeated prompts."""
+    return GOOGLE_SEARCH_URL.format(query=quote_plus(text))
+
+def _remaining_ms(deadline, cap_ms: int) -> float:
+    """Returns cap_ms, shortened to the time left before deadline (if any)."""
+    if deadline is None:
+        return cap_ms
+    remaining = (deadline - time.monotonic()) * 1000
+    if remaining <= 0:
+        raise PlaywrightTimeoutError("Prompt deadline exceeded.")
+    return min(cap_ms, remaining)
+
+def run_prompt(page: Page, controller: GoogleAIController, text: str,
+               headful: bool = False, check_popups: bool = True,
+               deadline: float = None) -> str:
+    """Navigates to the AI-mode search for a prompt and returns the parsed response.
+
+    If deadline (a time.monotonic() value) is given, every wait is shortened to
+    end by then, raising PlaywrightTimeoutError if it passes.
+    """
+    url = build_search_url(text)
+    logging.info("Navigating to: %s", url)
+    # Listen before navigating so the first streamed chunk is seen.
+    controller.start_response_monitoring()
+    page.goto(url, wait_until="domcontentloaded", timeout=_remaining_ms(deadline, 60000))
+
+    if check_popups:
+        handle_initial_popups(page)
+
+    logging.info("Waiting for AI response container to appear (max 90s)...")
+    if headful:
+        logging.info("If a CAPTCHA appears, please solve it in the browser window.")
+
+    page.wait_for_selector(RESPONSE_CONTAINER_SELECTOR, state="visible",
+                           timeout=_remaining_ms(deadline, 90000))
+    logging.info("Response container found.")
+
+    _remaining_ms(deadline, 0)  # Raises if the deadline has already passed
+    controller.wait_for_response_completion(deadline=deadline)
+    return controller.extract_response_as_markdown()
+
+def launch_browser(headful: bool = False) -> Camoufox:
+    """Returns a Camoufox context manager for the persistent profile."""
+    os.makedirs(USER_DATA_DIR, exist_ok=True)
+    return Camoufox(
+        headless=not headful,
+        persistent_context=True,
+        user_data_dir=str(USER_DATA_DIR),
+        humanize=True
+    )
+
+def prompt(text: str, headful: bool = False, timeout: float = None) -> str:
+    """Sends one prompt in a fresh browser session and returns the response.
+
+    This is the in-process equivalent of the 'prompt' command for Python
+    callers. Errors propagate (e.g. PlaywrightTimeoutError) instead of exiting.
+    With a timeout (in seconds, counted from the call), the prompt gives up
+    with PlaywrightTimeoutError once it runs out, and the browser is closed
+    before returning either way.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with launch_browser(headful) as browser:
+        page = browser.new_page()
+        return run_prompt(page, GoogleAIController(page), text, headful, deadline=deadline)
+
+def serve(page: Page, controller: GoogleAIController, headful: bool = False, save: bool = False):
+    """Answers prompts read from stdin, one per line, reusing the open browser page.
+
+    Each response is followed by SERVE_END_MARKER on its own line. Every prompt
+    navigates to a fresh search URL, which already starts a new conversation,
+    so only the browser launch and cookie handling are amortized.
+    """
+    logging.info("Serving prompts from stdin, one per line. Send EOF to stop.")
+    popups_checked = False
+    for line in sys.stdin:
+        text = line.strip()
+        if not text:
+            continue
+        try:
+            response = run_prompt(page, controller, text, headful, check_popups=not popups_checked)
+        except PlaywrightTimeoutError:
+            logging.error("Prompt timed out: %s", text)
+            response = "Error: Operation timed out."
+        else:
+            popups_checked = True
+            if save:
+                save_conversation(text, response)
+        print(response)
+        print(SERVE_END_MARKER, flush=True)
 
 def main():
     """Main function to parse arguments and run the controller."""
@@ -54,7 +177,10 @@ def main():
         description="Control Google AI from the command line.",
         formatter_class=argparse.RawTextHelpFormatter
     )
-    parser.add_argument("command", choices=["prompt", "new"], help="The command to execute.")
+    parser.add_argument(
+        "command", choices=["prompt", "new", "serve"],
+        help="The command to execute. 'serve' reads prompts from stdin, one per line."
+    )
     parser.add_argument("text", nargs="?", default="", help="The prompt text to send.")
     parser.add_argument("--headful", action="store_true", help="Run in a visible browser window.")
     parser.add_argument("--save", action="store_true", help="Save the prompt and response to a history file.")
@@ -68,41 +194,23 @@ def main():
     if args.command == "prompt" and not args.text:
         parser.error("The 'prompt' command requires a text argument.")
 
-    os.makedirs(USER_DATA_DIR, exist_ok=True)
     logging.info("Using profile directory: %s", USER_DATA_DIR)
 
     try:
-        with Camoufox(
-            headless=not args.headful,
-            persistent_context=True,
-            user_data_dir=str(USER_DATA_DIR),
-            humanize=True
-        ) as browser:
+        with launch_browser(args.headful) as browser:
             page = browser.new_page()
             controller = GoogleAIController(page)
 
             if args.command == "prompt":
-                encoded_prompt = quote_plus(args.text)
-                url = GOOGLE_SEARCH_URL.format(query=encoded_prompt)
-                logging.info("Navigating to: %s", url)
-                page.goto(url, wait_until="domcontentloaded", timeout=60000)
-
-                handle_initial_popups(page)
-
-                logging.info("Waiting for AI response container to appear (max 90s)...")
-                if args.headful:
-                    logging.info("If a CAPTCHA appears, please solve it in the browser window.")
-
-                page.wait_for_selector(RESPONSE_CONTAINER_SELECTOR, state="visible", timeout=90000)
-                logging.info("Response container found.")
-
-                controller.wait_for_response_completion()
-                response = controller.extract_response_as_markdown()
+                response = run_prompt(page, controller, args.text, args.headful)
                 print(response)
 
                 if args.save:
                     save_conversation(args.text, response)
 
+            elif args.command == "serve":
+                serve(page, controller, args.headful, args.save)
+
             elif args.command == "new":
                 url = GOOGLE_SEARCH_URL.format(query="start new chat")
                 logging.info("Navigating to default page to start new chat...")
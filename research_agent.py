@@ -5,25 +5,196 @@ An autonomous research agent that uses a local AI model with function calling
 to perform iterative web searches and generate a detailed report.
 """
 import argparse
+import atexit
+import hashlib
 import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import sqlite3
 import subprocess
 import sys
-from typing import Dict, Any
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # Optional speed-up; fall back to the standard library
+    orjson = None
 
 # Use the official OpenAI library to connect to the compatible API
+import httpx
 import openai
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
 
 # --- Configuration ---
 # Your local AI server details
 OPENAI_API_BASE = "http://localhost:2048/v1"  # Standard for local servers
 OPENAI_API_KEY = "123456"  # The provided API key
 MODEL_NAME = "gemini-2.5-pro" # The provided model name
+REPORT_MODEL_NAME = "gemini-2.5-flash"  # Cheaper, faster model that writes the final report
+
+# HTTP client tuning for the AI server: keep connections alive across turns.
+# HTTP/2 is negotiated via TLS ALPN, so it only applies to https:// servers.
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=300)
+HTTP_TIMEOUT = httpx.Timeout(600, connect=10)
+
+# Retries for transient AI API failures (connection errors, 408/409/429, 5xx,
+# and streams that break partway through, which surface as httpx transport
+# errors or SSE error events), with exponential backoff plus jitter. The OpenAI
+# client's own retries only cover opening the stream.
+AI_MAX_ATTEMPTS = 5
+AI_RETRY_MAX_DELAY = 30  # Seconds
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429})
 
 # Path to the Google AI CLI tool
 GOOGLE_AI_CLI_PATH = "google_ai_cli/google_ai_cli.py"
+# Subprocess searches run the CLI with the same Python env; resolved once at import
+CLI_COMMAND_PREFIX = (sys.executable, os.path.abspath(GOOGLE_AI_CLI_PATH), "prompt")
+SEARCH_TIMEOUT = 180  # 3-minute timeout for each search call
+
+# On-disk cache of search results, keyed on the normalized query
+SEARCH_CACHE_PATH = ".research_cache.sqlite3"
+SEARCH_CACHE_TTL = 7 * 24 * 60 * 60  # 7 days, in seconds
+
+# Tool results from earlier turns are cut down, since the AI has already read
+# them; the latest turn's results always go out in full. research_data keeps
+# every full result for the final report.
+TRUNCATED_TOOL_RESULT_CHARS = 2000
+TRUNCATION_MARKER = "\n[... truncated]"
+
+# Snapshot of an in-progress run, rewritten after every iteration so --resume
+# can pick up after a crash without redoing searches. {} is a hash of the topic.
+AGENT_STATE_PATH = ".agent_state_{}.json"
+
+# Searches the AI may plan up front, run as one batch before the research loop
+MAX_PLANNED_QUERIES = 5
+
+# Longest single search result passed to the report writer
+REPORT_RESULT_MAX_CHARS = 8000
+
+# Optional semantic cache (needs sentence-transformers and faiss-cpu)
+SEMANTIC_CACHE_MODEL = "all-MiniLM-L6-v2"
+SEMANTIC_CACHE_INDEX_PATH = ".research_semantic_cache.faiss"
+SEMANTIC_CACHE_RESULTS_PATH = ".research_semantic_cache.json"
+SEMANTIC_CACHE_THRESHOLD = 0.92  # Minimum cosine similarity for a hit
+
+# --- JSON helpers ---
+def json_dumps(obj: Any, indent: bool = False) -> str:
+    """Serializes to a JSON string, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode("utf-8")
+    return json.dumps(obj, indent=2 if indent else None)
+
+
+def json_loads(data):
+    """Parses JSON, using orjson when it is installed.
+
+    Raises json.JSONDecodeError either way (orjson's error subclasses it).
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# --- In-process CLI ---
+_cli_prompt = None  # google_ai_cli.prompt, once imported
+_cli_import_attempted = False
+_cli_import_lock = threading.Lock()
+_cli_search_lock = threading.Lock()  # One browser at a time on the persistent profile
+
+# --- Search Cache ---
+_search_cache = None  # sqlite3 connection, opened on first use
+_search_cache_lock = threading.Lock()
+_search_cache_enabled = True
+_search_cache_ttl = SEARCH_CACHE_TTL
+
+
+def configure_search_cache(enabled: bool = True, ttl: int = SEARCH_CACHE_TTL):
+    """Enables or disables the search cache and sets how long entries stay fresh."""
+    global _search_cache_enabled, _search_cache_ttl
+    _search_cache_enabled = enabled
+    _search_cache_ttl = ttl
+
+
+def _search_cache_key(query: str) -> str:
+    """Normalizes a query into its cache key."""
+    return hashlib.sha1(query.strip().lower().encode("utf-8")).hexdigest()
+
+
+def _get_search_cache() -> sqlite3.Connection:
+    """Returns the cache connection, creating the database on first use."""
+    global _search_cache
+    if _search_cache is None:
+        _search_cache = sqlite3.connect(SEARCH_CACHE_PATH, check_same_thread=False)
+        _search_cache.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, ts INTEGER)"
+        )
+    return _search_cache
+
+
+def _cache_lookup(query: str) -> Optional[str]:
+    """Returns a fresh cached result for the query, or None on a miss."""
+    if not _search_cache_enabled:
+        return None
+    try:
+        with _search_cache_lock:
+            row = _get_search_cache().execute(
+                "SELECT value FROM cache WHERE key = ? AND ts > ?",
+                (_search_cache_key(query), int(time.time()) - _search_cache_ttl)
+            ).fetchone()
+    except sqlite3.Error as e:
+        logging.warning("Search cache lookup failed: %s", e)
+        return None
+    return row[0] if row else None
+
+
+def _cache_store(query: str, result: str):
+    """Stores a successful search result in the cache."""
+    if not _search_cache_enabled:
+        return
+    try:
+        with _search_cache_lock:
+            cache = _get_search_cache()
+            with cache:
+                cache.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, ts) VALUES (?, ?, ?)",
+                    (_search_cache_key(query), result, int(time.time()))
+                )
+    except sqlite3.Error as e:
+        logging.warning("Search cache write failed: %s", e)
 
 # --- Tool Definition ---
+# Built once at import and shared by every agent and turn, so the serialized
+# request bytes stay identical across calls.
+TOOLS_SCHEMA = [
+    {
+        "type": "function",
+        "function": {
+            "name": "search_google",
+            "description": (
+                "Searches Google using its AI mode to find information "
+                "on a given topic or question."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "The specific search query or question.",
+                    }
+                },
+                "required": ["query"],
+            },
+        },
+    }
+]
+
+
 def search_google(query: str) -> str:
     """
     Performs a search using the Google AI mode and returns the results.
@@ -37,25 +208,17 @@ def search_google(query: str) -> str:
         str: The search results from Google's AI mode, or an error message.
     """
     logging.info("Executing search tool with query: '%s'", query)
-    try:
-        # Use sys.executable to ensure we're using the same python env
-        command = [sys.executable, GOOGLE_AI_CLI_PATH, "prompt", query]
-
-        # Execute the command as a subprocess
-        process = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            check=True,  # Raise an exception for non-zero exit codes
-            timeout=180 # 3-minute timeout for the search call
-        )
-
-        logging.debug("Search tool raw stdout:\n%s", process.stdout)
-        if process.stderr:
-            logging.warning("Search tool raw stderr:\n%s", process.stderr)
-
-        return process.stdout.strip()
+    cached = _cache_lookup(query)
+    if cached is not None:
+        logging.info("Search cache hit for query: '%s'", query)
+        return cached
 
+    cli_prompt = _get_in_process_cli()
+    try:
+        if cli_prompt is not None:
+            result = _search_in_process(cli_prompt, query)
+        else:
+            result = _search_subprocess(query)
     except FileNotFoundError:
         error_msg = f"Error: The script '{GOOGLE_AI_CLI_PATH}' was not found."
         logging.error(error_msg)
@@ -68,9 +231,121 @@ def search_google(query: str) -> str:
         logging.error(error_msg)
         return error_msg
     except subprocess.TimeoutExpired:
-        error_msg = "Error: The search script timed out after 180 seconds."
+        error_msg = f"Error: The search script timed out after {SEARCH_TIMEOUT} seconds."
         logging.error(error_msg)
         return error_msg
+    except Exception as e:  # In-process failures surface as arbitrary exceptions
+        error_msg = f"Error: The search failed: {e}"
+        logging.error(error_msg)
+        return error_msg
+
+    # The CLI reports some failures (e.g. extraction) on stdout with exit code 0
+    if result and not result.startswith("Error:"):
+        _cache_store(query, result)
+    return result
+
+
+def _get_in_process_cli():
+    """
+    Imports the CLI's prompt() function on first use so searches can run
+    in-process. Returns None (subprocess fallback) if the import fails.
+    """
+    global _cli_prompt, _cli_import_attempted
+    with _cli_import_lock:
+        if not _cli_import_attempted:
+            _cli_import_attempted = True
+            # The CLI imports its siblings (config, ai_controller) by bare name.
+            cli_dir = os.path.dirname(os.path.abspath(GOOGLE_AI_CLI_PATH))
+            if cli_dir not in sys.path:
+                sys.path.insert(0, cli_dir)
+            try:
+                from google_ai_cli import prompt
+                _cli_prompt = prompt
+            except ImportError as e:
+                logging.warning("Running searches via subprocess; could not import the CLI: %s", e)
+        return _cli_prompt
+
+
+def _search_in_process(cli_prompt, query: str) -> str:
+    """
+    Runs a search through the imported CLI. The CLI enforces SEARCH_TIMEOUT
+    itself and closes its browser before returning, so a timed-out search
+    never leaves the profile held by a browser nobody is waiting on.
+    """
+    # Searches take turns, since a second browser can't open the profile.
+    with _cli_search_lock:
+        return cli_prompt(query, timeout=SEARCH_TIMEOUT).strip()
+
+
+def _search_subprocess(query: str) -> str:
+    """Runs a search by invoking the CLI script in a child Python process."""
+    command = CLI_COMMAND_PREFIX + (query,)
+
+    # Execute the command as a subprocess
+    process = subprocess.run(
+        command,
+        capture_output=True,
+        text=True,
+        check=True,  # Raise an exception for non-zero exit codes
+        timeout=SEARCH_TIMEOUT
+    )
+
+    logging.debug("Search tool raw stdout:\n%s", process.stdout)
+    if process.stderr:
+        logging.warning("Search tool raw stderr:\n%s", process.stderr)
+
+    return process.stdout.strip()
+
+
+class SemanticSearchCache:
+    """
+    Reuses search results for queries that are worded differently but mean the
+    same thing, by comparing normalized sentence embeddings in a FAISS
+    inner-product index. Requires the optional `sentence-transformers` and
+    `faiss-cpu` packages; the constructor raises ImportError without them.
+    """
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        import faiss
+        from sentence_transformers import SentenceTransformer
+
+        self._faiss = faiss
+        self.model = SentenceTransformer(SEMANTIC_CACHE_MODEL)
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        if os.path.exists(SEMANTIC_CACHE_INDEX_PATH) and os.path.exists(SEMANTIC_CACHE_RESULTS_PATH):
+            self.index = faiss.read_index(SEMANTIC_CACHE_INDEX_PATH)
+            with open(SEMANTIC_CACHE_RESULTS_PATH, "rb") as f:
+                self.results = json_loads(f.read())
+            logging.info("Loaded %d semantic cache entries.", len(self.results))
+        else:
+            self.index = faiss.IndexFlatIP(self.model.get_sentence_embedding_dimension())
+            self.results = []
+
+    def get_or_search(self, query: str, search) -> str:
+        """Returns the result for a similar cached query, or runs `search` and caches it."""
+        embedding = self.model.encode([query], normalize_embeddings=True).astype("float32")
+        with self._lock:
+            if self.index.ntotal:
+                scores, ids = self.index.search(embedding, 1)
+                if scores[0][0] >= self.threshold:
+                    logging.info("Semantic cache hit (similarity %.3f) for query: '%s'",
+                                 scores[0][0], query)
+                    return self.results[ids[0][0]]
+
+        result = search(query=query)
+        if result and not result.startswith("Error:"):
+            with self._lock:
+                self.index.add(embedding)
+                self.results.append(result)
+        return result
+
+    def save(self):
+        """Writes the index and its results to disk for the next run."""
+        with self._lock:
+            self._faiss.write_index(self.index, SEMANTIC_CACHE_INDEX_PATH)
+            with open(SEMANTIC_CACHE_RESULTS_PATH, "w", encoding="utf-8") as f:
+                f.write(json_dumps(self.results))
+        logging.info("Saved %d semantic cache entries.", len(self.results))
 
 
 class ResearchAgent:
@@ -78,61 +353,166 @@ class ResearchAgent:
     Orchestrates the research process by managing interaction with the AI model
     and executing tools.
     """
-    def __init__(self, model: str, api_base: str, api_key: str):
+    # Invariant prompt prefixes. Keeping them as constants (like TOOLS_SCHEMA)
+    # and never editing earlier history entries keeps every request's prefix
+    # byte-identical, so the provider's prefix caching can reuse it.
+    SYSTEM_PROMPT = (
+        "You are an expert research assistant. Your goal is to gather "
+        "comprehensive information about the user's topic. "
+        "Think step-by-step. First, formulate a search query to start. "
+        "Then, use the `search_google` tool to find information. "
+        "Analyze the results, and decide if you need more information. "
+        "If so, formulate a new, more specific query to dig deeper or explore a new angle. "
+        "When you are confident you have enough information to write a detailed report, "
+        "respond with the final message 'RESEARCH_COMPLETE' and nothing else."
+    )
+
+    PLAN_PROMPT = (
+        "You are an expert research planner. Given a research topic, choose the "
+        f"most useful distinct search queries (at most {MAX_PLANNED_QUERIES}) that "
+        "together cover its key angles. Respond with a JSON object of the form "
+        '{"queries": ["first query", "second query"]} and nothing else.'
+    )
+
+    REPORT_PROMPT = (
+        "You are a report writing expert. You have been provided with a series of "
+        "research queries and their corresponding results in JSON format. "
+        "Your task is to synthesize all of this information into a single, "
+        "well-structured report. The report must follow this format exactly:\n\n"
+        "1.  **TL;DR:** A brief, concise summary (2-4 sentences) of the most "
+        "critical findings.\n"
+        "2.  **Detailed Findings:** A comprehensive section that elaborates on the "
+        "information discovered. Use markdown for formatting (e.g., headings, "
+        "bullet points) to organize the content clearly. Synthesize information from "
+        "different searches where appropriate."
+    )
+
+    def __init__(self, model: str, api_base: str, api_key: str,
+                 semantic_cache: Optional[SemanticSearchCache] = None,
+                 plan_queries: bool = True, report_model: Optional[str] = None):
         self.model = model
-        self.client = openai.OpenAI(base_url=api_base, api_key=api_key)
+        self.report_model = report_model or model
+        self.client = openai.OpenAI(
+            base_url=api_base,
+            api_key=api_key,
+            http_client=httpx.Client(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT),
+            max_retries=0,  # _call_ai does its own retrying
+        )
         self.conversation_history = []
         self.research_data = [] # Stores (query, result) tuples
-        self.tool_map = {"search_google": search_google}
-        self.tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "search_google",
-                    "description": (
-                        "Searches Google using its AI mode to find information "
-                        "on a given topic or question."
-                    ),
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "The specific search query or question.",
-                            }
-                        },
-                        "required": ["query"],
-                    },
-                },
-            }
-        ]
-
-    def _call_ai(self, messages: list, use_tools: bool = True) -> Dict[str, Any]:
+        self.semantic_cache = semantic_cache
+        self.plan_queries = plan_queries
+        self._query_memo: Dict[str, str] = {}  # Normalized query -> result, per run
+        self.tool_map = {"search_google": self._search_google}
+        self.tools = TOOLS_SCHEMA
+
+    def _search_google(self, query: str) -> str:
+        """Runs search_google, consulting the semantic cache first when enabled."""
+        if self.semantic_cache is None:
+            return search_google(query=query)
+        return self.semantic_cache.get_or_search(query, search_google)
+
+    def _call_ai(self, messages: list, use_tools: bool = True,
+                 response_format: Optional[Dict[str, Any]] = None,
+                 model: Optional[str] = None) -> ChatCompletionMessage:
         """A wrapper for making calls to the OpenAI compatible API."""
-        logging.debug("Sending messages to AI: %s", json.dumps(messages, indent=2))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Sending messages to AI: %s", json_dumps(messages, indent=True))
+        for attempt in range(AI_MAX_ATTEMPTS):
+            try:
+                stream = self.client.chat.completions.create(
+                    model=model or self.model,
+                    messages=messages,
+                    # Omit the keys entirely (not null) so tool-free calls carry no schema.
+                    tools=self.tools if use_tools else openai.NOT_GIVEN,
+                    tool_choice="auto" if use_tools else openai.NOT_GIVEN,
+                    response_format=response_format or openai.NOT_GIVEN,
+                    stream=True,
+                )
+                return self._collect_stream(stream)
+            except openai.APIConnectionError as e:
+                if attempt == AI_MAX_ATTEMPTS - 1:
+                    logging.error("Failed to connect to the AI server at %s. Is it running?", self.client.base_url)
+                    raise e
+                error = e
+            except openai.APIStatusError as e:
+                retryable = e.status_code >= 500 or e.status_code in RETRYABLE_STATUS_CODES
+                if not retryable or attempt == AI_MAX_ATTEMPTS - 1:
+                    logging.error("Received an error from the AI API: %s", e)
+                    raise e
+                error = e
+            except (httpx.TransportError, openai.APIError) as e:
+                # Raised while reading an open stream: a dropped connection, or
+                # an error event sent by the server mid-stream.
+                if isinstance(e, openai.APIResponseValidationError) or attempt == AI_MAX_ATTEMPTS - 1:
+                    logging.error("The AI response stream failed: %s", e)
+                    raise e
+                error = e
+            delay = min(AI_RETRY_MAX_DELAY, 2 ** attempt) + random.random()
+            logging.warning("AI call failed (%s); retrying in %.1f seconds (attempt %d of %d).",
+                            error, delay, attempt + 2, AI_MAX_ATTEMPTS)
+            time.sleep(delay)
+
+    def _collect_stream(self, stream) -> ChatCompletionMessage:
+        """
+        Assembles a streamed completion into the message a non-streaming call
+        would return, echoing text to stderr as it arrives to show progress.
+        """
+        content_parts = []
+        tool_calls = []  # Accumulated {"id", "name", "arguments"} per call
+        slots = {}  # Stream index -> position in tool_calls
+
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                tools=self.tools if use_tools else None,
-                tool_choice="auto" if use_tools else None,
-            )
-            return response.choices[0].message
-        except openai.APIConnectionError as e:
-            logging.error("Failed to connect to the AI server at %s. Is it running?", self.client.base_url)
-            raise e
-        except openai.APIStatusError as e:
-            logging.error("Received an error from the AI API: %s", e)
-            raise e
-
-
-    def run(self, topic: str, max_iterations: int = 5) -> str:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_parts.append(delta.content)
+                    sys.stderr.write(delta.content)
+                    sys.stderr.flush()
+                for fragment in delta.tool_calls or []:
+                    slot = slots.get(fragment.index)
+                    # Some servers reuse an index for separate calls; a new id
+                    # always starts a new call.
+                    if slot is None or (fragment.id and tool_calls[slot]["id"] not in (None, fragment.id)):
+                        slot = slots[fragment.index] = len(tool_calls)
+                        tool_calls.append({"id": None, "name": "", "arguments": []})
+                    call = tool_calls[slot]
+                    if fragment.id:
+                        call["id"] = fragment.id
+                    if fragment.function:
+                        if fragment.function.name:
+                            call["name"] = fragment.function.name
+                        if fragment.function.arguments:
+                            call["arguments"].append(fragment.function.arguments)
+        finally:
+            # Also ends a partial echo, so a retried response starts on a new line.
+            if content_parts:
+                sys.stderr.write("\n")
+
+        return ChatCompletionMessage(
+            role="assistant",
+            content="".join(content_parts) or None,
+            tool_calls=[
+                ChatCompletionMessageToolCall(
+                    id=call["id"] or f"call_{i}",
+                    type="function",
+                    function=Function(name=call["name"], arguments="".join(call["arguments"])),
+                )
+                for i, call in enumerate(tool_calls)
+            ] or None,
+        )
+
+    def run(self, topic: str, max_iterations: int = 5, resume: bool = False) -> str:
         """
         Starts and manages the research process for a given topic.
 
         Args:
             topic (str): The initial research topic.
             max_iterations (int): The maximum number of search cycles to perform.
+            resume (bool): Continue from the saved state of an interrupted run
+                on the same topic, if there is one.
 
         Returns:
             str: The final, formatted research report.
@@ -141,22 +521,22 @@ class ResearchAgent:
         logging.info("Topic: %s", topic)
         logging.info("Max Iterations: %d", max_iterations)
 
-        system_prompt = (
-            "You are an expert research assistant. Your goal is to gather "
-            "comprehensive information about the user's topic. "
-            "Think step-by-step. First, formulate a search query to start. "
-            "Then, use the `search_google` tool to find information. "
-            "Analyze the results, and decide if you need more information. "
-            "If so, formulate a new, more specific query to dig deeper or explore a new angle. "
-            "When you are confident you have enough information to write a detailed report, "
-            "respond with the final message 'RESEARCH_COMPLETE' and nothing else."
-        )
-        self.conversation_history = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Please research the following topic: {topic}"}
-        ]
-
-        for i in range(max_iterations):
+        state_path = AGENT_STATE_PATH.format(hashlib.sha1(topic.encode("utf-8")).hexdigest()[:16])
+        start_iteration = self._load_state(state_path) if resume else None
+
+        if start_iteration is None:
+            start_iteration = 0
+            self._query_memo = {}
+            self.research_data = []
+            self.conversation_history = [
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": f"Please research the following topic: {topic}"}
+            ]
+            if self.plan_queries:
+                self._run_planned_queries(topic)
+                self._save_state(state_path, 0)
+
+        for i in range(start_iteration, max_iterations):
             logging.info("--- Research Iteration %d/%d ---", i + 1, max_iterations)
             print(f"\n[STATUS] Research Iteration {i + 1}/{max_iterations}...")
 
@@ -165,47 +545,219 @@ class ResearchAgent:
 
             if ai_response.tool_calls:
                 logging.info("AI decided to use a tool.")
-                for tool_call in ai_response.tool_calls:
-                    self._execute_tool_call(tool_call)
-            elif "RESEARCH_COMPLETE" in (ai_response.content or ""):
+                self._execute_tool_calls(ai_response.tool_calls)
+                self._compact_tool_results()
+                self._save_state(state_path, i + 1)
+            elif (ai_response.content or "").lstrip().startswith("RESEARCH_COMPLETE"):
                 logging.info("AI signaled research is complete.")
                 print("[STATUS] Research phase complete. Generating final report...")
-                return self._generate_final_report()
+                break
             else:
                 logging.warning("AI did not use a tool or signal completion. Ending research.")
                 print("[STATUS] AI provided a response without searching. Generating report from available data...")
-                return self._generate_final_report()
+                break
+        else:
+            logging.warning("Reached max iterations. Moving to report generation.")
+            print("\n[STATUS] Reached max search iterations. Generating final report...")
+
+        report = self._generate_final_report()
+        try:
+            os.remove(state_path)
+        except FileNotFoundError:
+            pass
+        return report
+
+    def _save_state(self, path: str, next_iteration: int):
+        """Writes the history and research data so far, replacing any earlier snapshot."""
+        state = {
+            "next_iteration": next_iteration,
+            "conversation_history": self.conversation_history,
+            "research_data": self.research_data,
+        }
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json_dumps(state))
+            os.replace(tmp_path, path)  # Never leave a half-written snapshot behind
+        except OSError as e:
+            logging.warning("Could not save agent state to %s: %s", path, e)
+
+    def _load_state(self, path: str) -> Optional[int]:
+        """
+        Restores a snapshot written by _save_state.
+
+        Returns:
+            int: The iteration to continue from, or None if there is no usable
+            snapshot (the run then starts fresh).
+        """
+        try:
+            with open(path, "rb") as f:
+                state = json_loads(f.read())
+        except FileNotFoundError:
+            logging.info("No saved state at %s; starting a new run.", path)
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning("Ignoring unreadable agent state at %s: %s", path, e)
+            return None
+
+        self.conversation_history = state["conversation_history"]
+        self.research_data = state["research_data"]
+        self._query_memo = {
+            self._memo_key(entry["query"]): entry["result"]
+            for entry in self.research_data
+            if not entry["result"].startswith("Error:")
+        }
+        logging.info("Resuming from %s: %d searches done, continuing at iteration %d.",
+                     path, len(self.research_data), state["next_iteration"] + 1)
+        print(f"[STATUS] Resuming previous run ({len(self.research_data)} searches already done)...")
+        return state["next_iteration"]
+
+    def _plan(self, topic: str) -> list:
+        """
+        Asks the AI for an up-front batch of search queries in JSON mode.
+
+        Returns:
+            list: Up to MAX_PLANNED_QUERIES queries, or an empty list if the
+            server rejects JSON mode or returns something unusable.
+        """
+        messages = [
+            {"role": "system", "content": self.PLAN_PROMPT},
+            {"role": "user", "content": f"Topic: {topic}"}
+        ]
+        try:
+            response = self._call_ai(messages, use_tools=False, response_format={"type": "json_object"})
+            plan = json_loads(response.content or "")
+        except (openai.APIError, httpx.TransportError, json.JSONDecodeError) as e:
+            logging.warning("Query planning failed (%s). Continuing without a plan.", e)
+            return []
+        queries = plan.get("queries") if isinstance(plan, dict) else None
+        if not isinstance(queries, list):
+            logging.warning("Query plan has no list of queries. Continuing without a plan.")
+            return []
+        return [q.strip() for q in queries if isinstance(q, str) and q.strip()][:MAX_PLANNED_QUERIES]
+
+    def _run_planned_queries(self, topic: str):
+        """
+        Runs the planned queries as one batch and records them in the history as
+        an assistant tool-call turn, so the research loop starts from their
+        results and only has to decide whether more searching is needed.
+        """
+        queries = self._plan(topic)
+        if not queries:
+            return
+        logging.info("Running %d planned queries.", len(queries))
+        print(f"\n[STATUS] Running {len(queries)} planned searches...")
+
+        planned_message = ChatCompletionMessage(
+            role="assistant",
+            content=None,
+            tool_calls=[
+                ChatCompletionMessageToolCall(
+                    id=f"plan_{i}",
+                    type="function",
+                    function=Function(name="search_google", arguments=json_dumps({"query": query})),
+                )
+                for i, query in enumerate(queries)
+            ],
+        )
+        self.conversation_history.append(planned_message.model_dump())
+        self._execute_tool_calls(planned_message.tool_calls)
+        self._compact_tool_results()
+
+    def _execute_tool_calls(self, tool_calls: list):
+        """
+        Runs the requested tool calls one at a time (each uncached search opens
+        the CLI's browser on its single persistent profile) and appends their
+        results to history in the order requested.
+        """
+        for tool_call in tool_calls:
+            memo_key = self._tool_call_memo_key(tool_call)
+            if memo_key in self._query_memo:
+                # Already researched this run; the result is in research_data.
+                logging.info("Reusing result of an earlier identical query: '%s'", memo_key)
+                tool_message = self._tool_message(tool_call, self._query_memo[memo_key])
+            else:
+                tool_message, research_entry = self._execute_tool_call(tool_call)
+                if research_entry is not None:
+                    self.research_data.append(research_entry)
+                    if not research_entry["result"].startswith("Error:"):
+                        self._query_memo[memo_key] = research_entry["result"]
+            logging.debug("Appending tool result to conversation history.")
+            self.conversation_history.append(tool_message)
 
-        logging.warning("Reached max iterations. Moving to report generation.")
-        print("\n[STATUS] Reached max search iterations. Generating final report...")
-        return self._generate_final_report()
+    @staticmethod
+    def _memo_key(query: Optional[str]) -> str:
+        """Normalizes a query for the per-run memo."""
+        return (query or "").strip().lower()
 
-    def _execute_tool_call(self, tool_call: Dict[str, Any]):
-        """Executes a tool call requested by the AI and appends the result to history."""
+    def _tool_call_memo_key(self, tool_call) -> Optional[str]:
+        """Returns the memo key of a search call, or None if it isn't a valid one."""
+        if tool_call.function.name not in self.tool_map:
+            return None
+        try:
+            args = json_loads(tool_call.function.arguments)
+        except json.JSONDecodeError:
+            return None
+        return self._memo_key(args.get("query")) if isinstance(args, dict) else None
+
+    @staticmethod
+    def _tool_message(tool_call, content: str) -> Dict[str, Any]:
+        """Builds the tool-result message answering a tool call."""
+        return {"role": "tool", "tool_call_id": tool_call.id, "name": tool_call.function.name, "content": content}
+
+    def _compact_tool_results(self):
+        """
+        Truncates the tool results the AI has already been shown, i.e. those
+        before the latest assistant message, so each AI call doesn't re-send
+        every full result. Results of the latest turn are left intact.
+        """
+        last_assistant = max(
+            (i for i, message in enumerate(self.conversation_history)
+             if message.get("role") == "assistant"),
+            default=0
+        )
+        tool_indices = [
+            i for i, message in enumerate(self.conversation_history[:last_assistant])
+            if message.get("role") == "tool"
+        ]
+        for i in tool_indices:
+            message = self.conversation_history[i]
+            content = message["content"]
+            if len(content) > TRUNCATED_TOOL_RESULT_CHARS and not content.endswith(TRUNCATION_MARKER):
+                logging.debug("Truncating tool result %s in history.", message["tool_call_id"])
+                self.conversation_history[i] = {
+                    **message,
+                    "content": content[:TRUNCATED_TOOL_RESULT_CHARS] + TRUNCATION_MARKER
+                }
+
+    def _execute_tool_call(self, tool_call: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        Executes a tool call requested by the AI without touching shared state.
+
+        Returns:
+            tuple: The tool message for the conversation history, and the
+            research entry to record (None if the tool did not run).
+        """
         func_name = tool_call.function.name
         try:
-            args = json.loads(tool_call.function.arguments)
+            args = json_loads(tool_call.function.arguments)
             query = args.get("query")
             logging.info("AI wants to call '%s' with query: '%s'", func_name, query)
             print(f"[SEARCHING] AI is searching for: \"{query}\"")
 
+            research_entry = None
             if func_name in self.tool_map:
                 tool_function = self.tool_map[func_name]
                 result = tool_function(query=query)
-                self.research_data.append({"query": query, "result": result})
+                research_entry = {"query": query, "result": result}
             else:
                 logging.error("AI tried to call unknown function: %s", func_name)
                 result = f"Error: Unknown tool '{func_name}'."
 
-            logging.debug("Appending tool result to conversation history.")
-            self.conversation_history.append(
-                {"role": "tool", "tool_call_id": tool_call.id, "name": func_name, "content": result}
-            )
+            return self._tool_message(tool_call, result), research_entry
         except json.JSONDecodeError:
             logging.error("Failed to decode JSON arguments from AI: %s", tool_call.function.arguments)
-            self.conversation_history.append(
-                {"role": "tool", "tool_call_id": tool_call.id, "name": func_name, "content": "Error: Invalid arguments format."}
-            )
+            return self._tool_message(tool_call, "Error: Invalid arguments format."), None
 
     def _generate_final_report(self) -> str:
         """
@@ -214,27 +766,23 @@ class ResearchAgent:
         if not self.research_data:
             return "No research was conducted. Could not generate a report."
 
-        logging.info("Generating final report from %d research entries.", len(self.research_data))
-
-        report_prompt = (
-            "You are a report writing expert. You have been provided with a series of "
-            "research queries and their corresponding results in JSON format. "
-            "Your task is to synthesize all of this information into a single, "
-            "well-structured report. The report must follow this format exactly:\n\n"
-            "1.  **TL;DR:** A brief, concise summary (2-4 sentences) of the most "
-            "critical findings.\n"
-            "2.  **Detailed Findings:** A comprehensive section that elaborates on the "
-            "information discovered. Use markdown for formatting (e.g., headings, "
-            "bullet points) to organize the content clearly. Synthesize information from "
-            "different searches where appropriate."
-        )
+        # One entry per distinct query (the latest result wins), each capped so
+        # a few very long pages can't crowd out the rest of the research.
+        unique = {}
+        for entry in self.research_data:
+            key = self._memo_key(entry["query"])
+            unique[key] = {"query": entry["query"], "result": entry["result"][:REPORT_RESULT_MAX_CHARS]}
+        report_data = list(unique.values())
+
+        logging.info("Generating final report from %d research entries (%d unique).",
+                     len(self.research_data), len(report_data))
 
         messages = [
-            {"role": "system", "content": report_prompt},
-            {"role": "user", "content": json.dumps(self.research_data, indent=2)}
+            {"role": "system", "content": self.REPORT_PROMPT},
+            {"role": "user", "content": json_dumps(report_data, indent=True)}
         ]
 
-        final_report_message = self._call_ai(messages, use_tools=False)
+        final_report_message = self._call_ai(messages, use_tools=False, model=self.report_model)
         logging.info("Successfully generated final report.")
         return final_report_message.content
 
@@ -251,25 +799,77 @@ def main():
         help="Maximum number of search iterations (default: 5)."
     )
     parser.add_argument("--debug", action="store_true", help="Enable verbose debug logging.")
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help=f"Bypass the on-disk search cache ({SEARCH_CACHE_PATH})."
+    )
+    parser.add_argument(
+        "--cache-ttl", type=int, default=SEARCH_CACHE_TTL,
+        help=f"Seconds a cached search result stays valid (default: {SEARCH_CACHE_TTL})."
+    )
+    parser.add_argument(
+        "--no-plan", action="store_true",
+        help="Skip the up-front batch of planned searches and let the AI\n"
+             "choose every query iteratively."
+    )
+    parser.add_argument(
+        "--semantic-cache", action="store_true",
+        help="Reuse results of semantically similar past queries\n"
+             "(requires sentence-transformers and faiss-cpu)."
+    )
+    parser.add_argument(
+        "--report-model", type=str, default=REPORT_MODEL_NAME,
+        help=f"Model that writes the final report (default: {REPORT_MODEL_NAME}).\n"
+             f"Pass {MODEL_NAME} to use the research model for it too."
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Continue an interrupted run on the same topic from its saved\n"
+             "state instead of starting over."
+    )
     args = parser.parse_args()
 
     log_level = logging.DEBUG if args.debug else logging.INFO
+    # Records are only enqueued on the calling thread; a listener thread does
+    # the formatting and the file/console writes.
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+    handlers = [logging.FileHandler("research_agent.log"), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.Queue(-1)
+    log_listener = logging.handlers.QueueListener(log_queue, *handlers)
+    log_listener.start()
+    atexit.register(log_listener.stop)
     logging.basicConfig(
         level=log_level,
-        format='%(asctime)s - %(levelname)s - %(module)s - %(message)s',
-        handlers=[
-            logging.FileHandler("research_agent.log"),
-            logging.StreamHandler()
-        ]
+        format='%(message)s',  # The listener's handlers apply the real format
+        handlers=[logging.handlers.QueueHandler(log_queue)],
+        force=True
     )
 
+    configure_search_cache(enabled=not args.no_cache, ttl=args.cache_ttl)
+
+    semantic_cache = None
+    if args.semantic_cache and not args.no_cache:
+        try:
+            semantic_cache = SemanticSearchCache()
+        except ImportError as e:
+            logging.warning("Semantic cache disabled, missing dependency: %s", e)
+
     try:
         agent = ResearchAgent(
             model=MODEL_NAME,
             api_base=OPENAI_API_BASE,
-            api_key=OPENAI_API_KEY
+            api_key=OPENAI_API_KEY,
+            semantic_cache=semantic_cache,
+            plan_queries=not args.no_plan,
+            report_model=args.report_model
         )
-        final_report = agent.run(topic=args.topic, max_iterations=args.iterations)
+        try:
+            final_report = agent.run(topic=args.topic, max_iterations=args.iterations, resume=args.resume)
+        finally:
+            if semantic_cache is not None:
+                semantic_cache.save()
 
         print("\n\n" + "="*80)
         print("                         FINAL RESEARCH REPORT")
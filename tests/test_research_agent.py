@@ -0,0 +1,99 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import openai
+import research_agent
+from openai.types.chat import ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
+
+
+def make_tool_call(call_id, query):
+    return ChatCompletionMessageToolCall(
+        id=call_id,
+        type="function",
+        function=Function(name="search_google", arguments=research_agent.json_dumps({"query": query})),
+    )
+
+
+def make_agent():
+    agent = research_agent.ResearchAgent("model", "http://127.0.0.1:9/v1", "key")
+    long_result = "x" * (research_agent.TRUNCATED_TOOL_RESULT_CHARS * 2)
+    agent.tool_map = {"search_google": lambda query: f"{query}: {long_result}"}
+    agent.conversation_history = [
+        {"role": "system", "content": "system"},
+        {"role": "user", "content": "topic"},
+    ]
+    return agent
+
+
+def run_turn(agent, queries, prefix):
+    tool_calls = [make_tool_call(f"{prefix}_{i}", q) for i, q in enumerate(queries)]
+    agent.conversation_history.append({"role": "assistant", "content": None, "tool_calls": tool_calls})
+    agent._execute_tool_calls(tool_calls)
+    agent._compact_tool_results()
+
+
+def tool_contents(agent, prefix):
+    return [
+        message["content"] for message in agent.conversation_history
+        if message.get("role") == "tool" and message["tool_call_id"].startswith(prefix)
+    ]
+
+
+class CompactToolResultsTest(unittest.TestCase):
+    def test_latest_turn_results_are_not_truncated(self):
+        agent = make_agent()
+        run_turn(agent, ["a", "b", "c", "d", "e"], "plan")
+
+        contents = tool_contents(agent, "plan")
+        self.assertEqual(len(contents), 5)
+        for content in contents:
+            self.assertFalse(content.endswith(research_agent.TRUNCATION_MARKER))
+
+    def test_earlier_turn_results_are_truncated(self):
+        agent = make_agent()
+        run_turn(agent, ["a", "b", "c"], "first")
+        run_turn(agent, ["d", "e", "f"], "second")
+
+        for content in tool_contents(agent, "first"):
+            self.assertTrue(content.endswith(research_agent.TRUNCATION_MARKER))
+        for content in tool_contents(agent, "second"):
+            self.assertFalse(content.endswith(research_agent.TRUNCATION_MARKER))
+
+
+def content_chunk(text):
+    delta = SimpleNamespace(content=text, tool_calls=None)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def broken_stream(error):
+    yield content_chunk("partial ")
+    raise error
+
+
+class CallAiRetryTest(unittest.TestCase):
+    def assert_retried_after(self, error):
+        agent = make_agent()
+        create = mock.Mock(side_effect=[broken_stream(error), iter([content_chunk("done")])])
+        agent.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        with mock.patch.object(research_agent.time, "sleep"), mock.patch.object(sys, "stderr"):
+            message = agent._call_ai([{"role": "user", "content": "hi"}])
+        self.assertEqual(message.content, "done")
+        self.assertEqual(create.call_count, 2)
+
+    def test_retries_dropped_stream(self):
+        self.assert_retried_after(httpx.ReadError("connection dropped"))
+
+    def test_retries_error_event_mid_stream(self):
+        request = httpx.Request("POST", "http://127.0.0.1:9/v1/chat/completions")
+        self.assert_retried_after(openai.APIError("stream error", request, body=None))
+
+
+if __name__ == "__main__":
+    unittest.main()